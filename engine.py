@@ -1,95 +1,587 @@
+import numpy as np
+
+def build_topo(root):
+    # a node's children are fixed at construction, so its topo order never changes
+    # and can be computed once and reused by every later backward() on the same graph
+    if root._topo is not None:
+        return root._topo
+
+    # iterative post-order DFS, so deep graphs don't hit the recursion limit
+    topo = []
+    visited = set()
+    stack = [(root, False)] if root._prev else []
+    while stack:
+        v, processed = stack.pop()
+        if processed:
+            topo.append(v)
+            continue
+        if id(v) in visited:
+            continue
+        visited.add(id(v))
+        stack.append((v, True))
+        for child in v._prev:
+            # leaves (inputs, constants, parameters) have nothing to recompute or propagate,
+            # so they are never pushed (a leaf root included) and the order holds only the
+            # nodes that do work
+            if child._prev:
+                stack.append((child, False))
+
+    root._topo = topo
+    root._arena = build_arena(topo)
+    return topo
+
+def build_arena(topo):
+    # move the data and grad of every interior tensor node into one contiguous block each,
+    # so forward() recomputes activations in place and backward() clears them with one fill.
+    # Nodes already packed by another root's graph stay where they are and, like scalar
+    # nodes, are reset one by one; returns (grad_arena, those_loose_nodes)
+    packed, loose = [], []
+    for v in topo:
+        if isinstance(v, TensorValue) and v.data.base is None:
+            packed.append(v)
+        else:
+            loose.append(v)
+    size = sum(v.data.size for v in packed)
+    data, grad = np.empty(size), np.zeros(size)
+    i = 0
+    for v in packed:
+        j = i + v.data.size
+        data[i:j] = v.data.ravel()
+        v.data = data[i:j].reshape(v.data.shape)
+        v.grad = grad[i:j].reshape(v.data.shape)
+        i = j
+    return grad, loose
+
+def axpby(a, b, alpha, beta):
+    # alpha*a + beta*b as a single node
+    a = a if isinstance(a, Value) else Leaf(a)
+    b = b if isinstance(b, Value) else Leaf(b)
+    return AxpbyValue(alpha * a.data + beta * b.data, (a, b), 'axpby', alpha, beta)
+
 class Value:
 
+    __slots__ = ('data', 'grad', '_prev', '_op', '_topo', '_arena')
+
     def __init__(self, data, _children=(), _op=''):
         self.data = data
         self.grad = 0
         # internal variables used for autograd graph construction
-        self._backward = lambda: None
-        self._prev = set(_children)
+        self._prev = _children if isinstance(_children, tuple) else tuple(_children) # operands, in order
         self._op = _op # the op that produced this node, for graphviz / debugging / etc
+        self._topo = None # cached topological order when this node is used as a backward() root
+        self._arena = None # (grad arena, unpacked interior nodes) set alongside _topo
 
     def __repr__(self):
         return f"Value(data={self.data}, grad={self.grad})"
 
-    def __add__(self, other):
-        other = other if isinstance(other, Value) else Value(other)
-        out = Value(self.data + other.data, (self, other), '+')
+    # each op is a Value subclass overriding these, so no closures are built per node
+    def _forward(self):
+        pass
 
-        def _backward():
-            self.grad += out.grad
-            other.grad += out.grad
-        out._backward = _backward
+    def _backward(self):
+        pass
 
-        return out
+    def __add__(self, other):
+        other = other if isinstance(other, Value) else Leaf(other)
+        return AddValue(self.data + other.data, (self, other), '+')
 
     def __mul__(self, other):
-        other = other if isinstance(other, Value) else Value(other)
-        out = Value(self.data * other.data, (self, other), '*')
+        other = other if isinstance(other, Value) else Leaf(other)
+        return MulValue(self.data * other.data, (self, other), '*')
 
-        def _backward():
-            self.grad += other.data * out.grad
-            other.grad += self.data * out.grad
-        out._backward = _backward
+    # fast path for internal callers that already hold two Values: no coercion check
+    def _add_value(self, other):
+        return AddValue(self.data + other.data, (self, other), '+')
 
-        return out
-    
     def __pow__(self, other):
         assert isinstance(other, (int, float)), "only supporting int/float powers for now"
-        out = Value(self.data**other, (self,), f'**{other}')
-
-        def _backward():
-            self.grad += (other * self.data**(other-1)) * out.grad
-        out._backward = _backward
+        # the common exponents get nodes whose backward needs no pow() call
+        if other == 2:
+            return SquareValue(self.data * self.data, (self,), f'**{other}', other)
+        if other == -1:
+            return ReciprocalValue(1 / self.data, (self,), f'**{other}', other)
+        return PowValue(self.data**other, (self,), f'**{other}', other)
 
-        return out
-    
     def relu(self):
-        out = Value(0 if self.data < 0 else self.data, (self,), 'ReLU')
+        # float() copies, since a flattened parameter's data is a 0-d view that step() mutates
+        return ReLUValue(0 if self.data < 0 else float(self.data), (self,), 'ReLU')
 
-        def _backward():
-            self.grad += (out.data > 0) * out.grad
-        out._backward = _backward
+    def forward(self):
+        # recompute every node's data in place from its (possibly mutated) leaves,
+        # reusing the graph instead of rebuilding it
+        for v in build_topo(self):
+            v._forward()
 
-        return out
-    
     def backward(self):
+        topo = build_topo(self)
 
-        
-        topo = []
-        visited = set()
-        def build_topo(v):
-            if v not in visited:
-                visited.add(v)
-                for child in v._prev:
-                    build_topo(child)
-                topo.append(v)
-        build_topo(self)
-
-        
-        self.grad = 1
+        # the graph may be reused across calls, so clear stale grads on interior nodes
+        grad_arena, loose = self._arena
+        grad_arena.fill(0)
+        for v in loose:
+            v._reset_grad()
+        # a tensor root's grad may be a view into the arena, so seed it in place
+        if isinstance(self, TensorValue):
+            self.grad.fill(1)
+        else:
+            self.grad = 1
         for v in reversed(topo):
             v._backward()
-    
-    def __sub__(self, other): 
-        return self + (-other)
 
-    def __rsub__(self, other): 
-        return other + (-self)
+    def _reset_grad(self):
+        # a flattened scalar parameter holds a 0-d view into its module's grad buffer
+        if isinstance(self.grad, np.ndarray):
+            self.grad.fill(0)
+        else:
+            self.grad = 0
+
+    def __sub__(self, other):
+        return axpby(self, other, 1, -1)
+
+    def __rsub__(self, other):
+        return axpby(other, self, 1, -1)
 
-    def __rmul__(self, other): 
+    def __rmul__(self, other):
         return self * other
-    
+
     def __neg__(self): # -self
-        return self * -1
+        return NegValue(-self.data, (self,), 'neg')
 
-    def __radd__(self, other): 
+    def __radd__(self, other):
         return self + other
-    
-    def __truediv__(self, other): 
-        return self * other**-1
 
-    def __rtruediv__(self, other): 
-        return other * self**-1
+    def __truediv__(self, other):
+        other = other if isinstance(other, Value) else Leaf(other)
+        return DivValue(self.data / other.data, (self, other), '/')
+
+    def __rtruediv__(self, other):
+        return Leaf(other) / self
 
     def __repr__(self):
         return f"Value(data={self.data}, grad={self.grad})"
+
+
+class Leaf(Value):
+
+    # input data or a constant: it never needs a gradient, so the tensor ops skip computing
+    # gradients flowing into it and CompiledGraph doesn't write one back. Like every node
+    # without operands it is kept out of the topo order by build_topo
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"Leaf(data={self.data})"
+
+
+class AddValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, b = self._prev
+        self.data = a.data + b.data
+
+    def _backward(self):
+        a, b = self._prev
+        a.grad += self.grad
+        b.grad += self.grad
+
+    def _src(self, i, args):
+        a, b = args
+        return f"v[{i}] = v[{a}] + v[{b}]", [f"g[{a}] += g[{i}]", f"g[{b}] += g[{i}]"]
+
+class MulValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, b = self._prev
+        self.data = a.data * b.data
+
+    def _backward(self):
+        a, b = self._prev
+        a.grad += b.data * self.grad
+        b.grad += a.data * self.grad
+
+    def _src(self, i, args):
+        a, b = args
+        return f"v[{i}] = v[{a}] * v[{b}]", [f"g[{a}] += v[{b}] * g[{i}]", f"g[{b}] += v[{a}] * g[{i}]"]
+
+class PowValue(Value):
+
+    __slots__ = ('_exponent',)
+
+    def __init__(self, data, _children, _op, exponent):
+        super().__init__(data, _children, _op)
+        self._exponent = exponent
+
+    def _forward(self):
+        a, = self._prev
+        self.data = a.data**self._exponent
+
+    def _backward(self):
+        a, = self._prev
+        a.grad += (self._exponent * a.data**(self._exponent-1)) * self.grad
+
+    def _src(self, i, args):
+        a, = args
+        e = float(self._exponent)
+        return f"v[{i}] = v[{a}] ** {e!r}", [f"g[{a}] += {e!r} * v[{a}] ** {e - 1!r} * g[{i}]"]
+
+class SquareValue(PowValue):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        self.data = a.data * a.data
+
+    def _backward(self):
+        a, = self._prev
+        a.grad += 2 * a.data * self.grad
+
+    def _src(self, i, args):
+        a, = args
+        return f"v[{i}] = v[{a}] * v[{a}]", [f"g[{a}] += 2.0 * v[{a}] * g[{i}]"]
+
+class ReciprocalValue(PowValue):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        self.data = 1 / a.data
+
+    def _backward(self):
+        a, = self._prev
+        a.grad -= self.grad / (a.data * a.data)
+
+    def _src(self, i, args):
+        a, = args
+        return f"v[{i}] = 1.0 / v[{a}]", [f"g[{a}] -= g[{i}] / (v[{a}] * v[{a}])"]
+
+class ReLUValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        self.data = 0 if a.data < 0 else float(a.data)
+
+    def _backward(self):
+        a, = self._prev
+        a.grad += (self.data > 0) * self.grad
+
+    def _src(self, i, args):
+        a, = args
+        return f"v[{i}] = v[{a}] if v[{a}] > 0 else 0.0", [f"if v[{i}] > 0: g[{a}] += g[{i}]"]
+
+class AxpbyValue(Value):
+
+    __slots__ = ('_alpha', '_beta')
+
+    def __init__(self, data, _children, _op, alpha, beta):
+        super().__init__(data, _children, _op)
+        self._alpha = alpha
+        self._beta = beta
+
+    def _forward(self):
+        a, b = self._prev
+        self.data = self._alpha * a.data + self._beta * b.data
+
+    def _backward(self):
+        a, b = self._prev
+        a.grad += self._alpha * self.grad
+        b.grad += self._beta * self.grad
+
+    def _src(self, i, args):
+        a, b = args
+        alpha, beta = float(self._alpha), float(self._beta)
+        return f"v[{i}] = {alpha!r} * v[{a}] + {beta!r} * v[{b}]", [f"g[{a}] += {alpha!r} * g[{i}]", f"g[{b}] += {beta!r} * g[{i}]"]
+
+class NegValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        self.data = -a.data
+
+    def _backward(self):
+        a, = self._prev
+        a.grad -= self.grad
+
+    def _src(self, i, args):
+        a, = args
+        return f"v[{i}] = -v[{a}]", [f"g[{a}] -= g[{i}]"]
+
+class DivValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, b = self._prev
+        self.data = a.data / b.data
+
+    def _backward(self):
+        a, b = self._prev
+        a.grad += self.grad / b.data
+        b.grad -= self.grad * a.data / (b.data * b.data)
+
+    def _src(self, i, args):
+        a, b = args
+        return f"v[{i}] = v[{a}] / v[{b}]", [f"g[{a}] += g[{i}] / v[{b}]", f"g[{b}] -= g[{i}] * v[{a}] / (v[{b}] * v[{b}])"]
+
+
+class TensorValue(Value):
+
+    __slots__ = ()
+
+    def __init__(self, data, _children=(), _op=''):
+        super().__init__(np.asarray(data, dtype=float), _children, _op)
+        self.grad = np.zeros_like(self.data)
+
+    def __repr__(self):
+        return f"TensorValue(data={self.data}, grad={self.grad})"
+
+    def _reset_grad(self):
+        self.grad.fill(0)
+
+    @staticmethod
+    def stack(values):
+        # pack scalar Values (or plain numbers) into one vector, keeping the graph intact.
+        # Take our own copy so a generator isn't consumed twice and later changes to the
+        # caller's list don't swap operands under the node
+        values = tuple(values)
+        children = tuple(v for v in values if isinstance(v, Value))
+        return StackValue([v.data if isinstance(v, Value) else v for v in values], children, 'stack', values)
+
+    def dot(self, other):
+        return DotValue(float(np.dot(self.data, other.data)), (self, other), 'dot')
+
+    def linear(self, x, b):
+        # fused x @ W.T + b for a whole layer; self is the (nout, nin) weight matrix and
+        # x is either a single (nin,) sample or a (batch, nin) matrix
+        return LinearValue(x.data @ self.data.T + b.data, (self, x, b), 'linear')
+
+    def linear_relu(self, x, b):
+        # linear followed by ReLU as one node, saving the separate activation node and its buffer
+        return LinearReLUValue(x.data @ self.data.T + b.data, (self, x, b), 'linear_relu')
+
+    def relu(self):
+        return TensorReLUValue(np.maximum(0, self.data), (self,), 'ReLU')
+
+    def item(self):
+        # the single element of a size-1 tensor as a scalar Value
+        return ItemValue(self.data.item(), (self,), 'item')
+
+    def squared_error(self, target):
+        # ((self - target)**2).sum() as a single scalar node
+        # shapes must match exactly: broadcasting e.g. (batch, 1) against (batch,) would
+        # silently sum over a (batch, batch) matrix
+        if not isinstance(target, Value):
+            target = Leaf(np.asarray(target, dtype=float).reshape(self.data.shape))
+        if np.shape(target.data) != self.data.shape:
+            raise ValueError(f"squared_error target shape {np.shape(target.data)} does not match prediction shape {self.data.shape}")
+        diff = self.data - target.data
+        return SquaredErrorValue(float((diff * diff).sum()), (self, target), 'sse')
+
+
+class StackValue(TensorValue):
+
+    __slots__ = ('_values',)
+
+    def __init__(self, data, _children, _op, values):
+        super().__init__(data, _children, _op)
+        self._values = values
+
+    def _forward(self):
+        self.data[...] = [v.data if isinstance(v, Value) else v for v in self._values]
+
+    def _backward(self):
+        for v, g in zip(self._values, self.grad):
+            if isinstance(v, Value) and not isinstance(v, Leaf):
+                v.grad += g
+
+class DotValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, b = self._prev
+        self.data = float(np.dot(a.data, b.data))
+
+    def _backward(self):
+        a, b = self._prev
+        if not isinstance(a, Leaf):
+            a.grad += self.grad * b.data
+        if not isinstance(b, Leaf):
+            b.grad += self.grad * a.data
+
+class LinearValue(TensorValue):
+
+    __slots__ = ()
+
+    def _forward(self):
+        W, x, b = self._prev
+        np.matmul(x.data, W.data.T, out=self.data)
+        self.data += b.data
+
+    def _backward(self):
+        self._backprop(self.grad)
+
+    def _backprop(self, g):
+        W, x, b = self._prev
+        g2 = np.atleast_2d(g)
+        W.grad += g2.T @ np.atleast_2d(x.data)
+        b.grad += g2.sum(axis=0)
+        if not isinstance(x, Leaf):
+            x.grad += g @ W.data
+
+class LinearReLUValue(LinearValue):
+
+    __slots__ = ('_mask',)
+
+    def __init__(self, data, _children, _op):
+        super().__init__(data, _children, _op)
+        self._mask = self.data > 0
+        self.data *= self._mask
+
+    def _forward(self):
+        # recompute in place, also reusing the mask buffer
+        W, x, b = self._prev
+        np.matmul(x.data, W.data.T, out=self.data)
+        self.data += b.data
+        np.greater(self.data, 0, out=self._mask)
+        self.data *= self._mask
+
+    def _backward(self):
+        self._backprop(self.grad * self._mask)
+
+class TensorReLUValue(TensorValue):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        np.maximum(a.data, 0, out=self.data)
+
+    def _backward(self):
+        a, = self._prev
+        a.grad += (self.data > 0) * self.grad
+
+class ItemValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, = self._prev
+        self.data = a.data.item()
+
+    def _backward(self):
+        a, = self._prev
+        a.grad += self.grad
+
+class SquaredErrorValue(Value):
+
+    __slots__ = ()
+
+    def _forward(self):
+        a, target = self._prev
+        diff = a.data - target.data
+        self.data = float((diff * diff).sum())
+
+    def _backward(self):
+        a, target = self._prev
+        diff = a.data - target.data
+        a.grad += 2 * diff * self.grad
+        if not isinstance(target, Leaf):
+            target.grad -= 2 * diff * self.grad
+
+
+class CompiledGraph:
+
+    # emits the cached topo order of a scalar graph as one straight-line forward+backward
+    # function over flat value/grad buffers; it is jitted with numba when that is installed.
+    # Tensor ops are already single BLAS calls and are not supported here. Each scalar op
+    # provides its source lines through a _src(i, args) method.
+
+    def __init__(self, root):
+        # reject tensor graphs up front, before build_topo caches and packs them
+        stack, seen = [root], set()
+        while stack:
+            v = stack.pop()
+            if id(v) in seen:
+                continue
+            seen.add(id(v))
+            if isinstance(v, TensorValue) or np.ndim(v.data) or (v._prev and not hasattr(v, '_src')):
+                raise TypeError(f"CompiledGraph only supports scalar ops, got {v._op or type(v).__name__!r}")
+            stack.extend(v._prev)
+
+        self.root = root
+        self.topo = build_topo(root)
+        # leaves are not in the topo order, so slots are handed out as nodes are seen
+        index = {}
+        self.leaves = []
+        def slot(v):
+            if id(v) not in index:
+                index[id(v)] = len(index)
+                if not v._prev:
+                    self.leaves.append((index[id(v)], v))
+            return index[id(v)]
+
+        forward, backward = [], []
+        for v in self.topo:
+            if v._prev:
+                args = [slot(c) for c in v._prev]
+                fwd, bwd = v._src(slot(v), args)
+                forward.append(fwd)
+                backward.append(bwd)
+        self.root_slot = slot(root)
+        self.vals = np.zeros(len(index))
+        self.grads = np.zeros(len(index))
+        lines = forward + ["g[:] = 0.0", f"g[{self.root_slot}] = 1.0"]
+        for bwd in reversed(backward):
+            lines.extend(bwd)
+        self.source = "def kernel(v, g):\n" + "".join(f"    {line}\n" for line in lines)
+
+        namespace = {}
+        exec(compile(self.source, "<CompiledGraph>", "exec"), namespace)
+        # numba is optional and slow to import, so it is only pulled in when a graph is compiled
+        try:
+            from numba import njit
+        except ImportError: # fall back to the plain Python kernel
+            njit = None
+        self.kernel = njit(namespace['kernel']) if njit is not None else namespace['kernel']
+        if not self.check():
+            raise RuntimeError("generated kernel disagrees with the interpreted graph")
+
+    def __call__(self):
+        # refreshes root.data and accumulates into the (non-Leaf) leaves' grads, like
+        # root.forward() followed by root.backward(); interior nodes' data and grad are
+        # left untouched, they only exist in the kernel's buffers
+        vals, grads = self.vals, self.grads
+        for i, v in self.leaves:
+            vals[i] = v.data
+        self.kernel(vals, grads)
+        for i, v in self.leaves:
+            if not isinstance(v, Leaf):
+                v.grad += float(grads[i])
+        self.root.data = float(vals[self.root_slot])
+        self.root.grad = 1
+
+    def check(self):
+        # run the interpreter and the kernel from the same leaf values and compare the root
+        # value and the leaves' grads; every leaf's grad is restored afterwards
+        leaves = [v for _, v in self.leaves]
+        params = [v for v in leaves if not isinstance(v, Leaf)]
+        saved = [v.grad for v in leaves]
+        results = []
+        for run in (lambda: (self.root.forward(), self.root.backward()), self):
+            for v in leaves:
+                v.grad = 0
+            run()
+            results.append([self.root.data] + [float(v.grad) for v in params])
+        for v, g in zip(leaves, saved):
+            v.grad = g
+        return np.allclose(*results, equal_nan=True)
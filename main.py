@@ -1,4 +1,5 @@
-from engine import Value
+import numpy as np
+from engine import Leaf
 from nn import MLP
 
 
@@ -9,23 +10,28 @@ xs = [[2.0, 3.0, -1.0],
 
 ys = [0.0, 1.0, 1.0, 0.0]  
 
+# the whole dataset goes through the network as one (batch, nin) matrix
+X = Leaf(np.array(xs))
+Y = Leaf(np.array(ys).reshape(-1, 1))
+
 
 n = MLP(3, [4, 4, 1])
 
 
+# build the graph once; each epoch only refreshes its data and grads
+ypred = n(X)
+loss = ypred.squared_error(Y)
+
+
 for k in range(20):
     
-    ypred = [n(x) for x in xs]
-    
-    loss = sum((yout - ygt) ** 2 for ygt, yout in zip(ys, ypred))
+    loss.forward()
 
  
-    for p in n.parameters():
-        p.grad = 0.0
+    n.zero_grad()
     loss.backward()  
 
     
-    for p in n.parameters():
-        p.data += -0.1 * p.grad 
+    n.step(0.1)
 
     print(k, loss.data) 
@@ -1,11 +1,43 @@
-import random
-from engine import Value
+import numpy as np
+from engine import Value, TensorValue, Leaf
 
 class Module:
 
+    # flat storage backing every parameter's data/grad, set up by flatten_parameters()
+    _params_flat = None
+    _grads_flat = None
+
     def zero_grad(self):
+        if self._grads_flat is not None:
+            self._grads_flat.fill(0)
+            return
+        # in place, so a submodule's parameters stay views into its parent's flat buffers
+        for p in self.parameters():
+            p._reset_grad()
+
+    def step(self, lr):
+        if self._params_flat is not None:
+            self._params_flat -= lr * self._grads_flat
+            return
         for p in self.parameters():
-            p.grad = 0
+            if isinstance(p.data, np.ndarray):
+                p.data[...] -= lr * p.grad
+            else:
+                p.data -= lr * p.grad
+
+    def flatten_parameters(self):
+        # move all parameters into two contiguous buffers and rebind each p.data / p.grad
+        # to a view into them, so zero_grad and step become single vectorized ops
+        params = self.parameters()
+        shapes = [np.shape(p.data) for p in params]
+        self._params_flat = np.concatenate([np.ravel(p.data).astype(float) for p in params])
+        self._grads_flat = np.zeros_like(self._params_flat)
+        i = 0
+        for p, shape in zip(params, shapes):
+            j = i + int(np.prod(shape))
+            p.data = self._params_flat[i:j].reshape(shape)
+            p.grad = self._grads_flat[i:j].reshape(shape)
+            i = j
 
     def parameters(self):
         return []
@@ -13,40 +45,66 @@ class Module:
 class Neuron(Module):
 
     def __init__(self, nin, nonlin=True):
-        self.w = [Value(random.uniform(-1,1)) for _ in range(nin)]
+        self.w = TensorValue(np.random.uniform(-1,1,nin))
         self.b = Value(0)
         self.nonlin = nonlin
 
     def __call__(self, x):
-        act = sum((wi*xi for wi,xi in zip(self.w, x)), self.b)
+        x = x if isinstance(x, (TensorValue, Leaf)) else TensorValue.stack(x)
+        act = self.w.dot(x)._add_value(self.b)
         return act.relu() if self.nonlin else act
 
     def parameters(self):
-        return self.w + [self.b]
+        return [self.w, self.b]
 
     def __repr__(self):
-        return f"{'ReLU' if self.nonlin else 'Linear'}Neuron({len(self.w)})"
+        return f"{'ReLU' if self.nonlin else 'Linear'}Neuron({len(self.w.data)})"
     
 class Layer(Module):
 
-    def __init__(self, nin, nout, **kwargs):
-        self.neurons = [Neuron(nin, **kwargs) for _ in range(nout)]
+    def __init__(self, nin, nout, nonlin=True, W=None, b=None):
+        self.W = W if W is not None else TensorValue(np.random.uniform(-1,1,(nout,nin)))
+        self.b = b if b is not None else TensorValue(np.zeros(nout))
+        self.nonlin = nonlin
 
     def __call__(self, x):
-        out = [n(x) for n in self.neurons]
-        return out[0] if len(out) == 1 else out
+        x = x if isinstance(x, (TensorValue, Leaf)) else TensorValue.stack(x)
+        out = self.W.linear_relu(x, self.b) if self.nonlin else self.W.linear(x, self.b)
+        # a single sample through a single neuron gives back a scalar Value
+        return out.item() if out.data.shape == (1,) else out
 
     def parameters(self):
-        return [p for n in self.neurons for p in n.parameters()]
+        return [self.W, self.b]
 
     def __repr__(self):
-        return f"Layer of [{', '.join(str(n) for n in self.neurons)}]"
+        nout, nin = self.W.data.shape
+        neuron = f"{'ReLU' if self.nonlin else 'Linear'}Neuron({nin})"
+        return f"Layer of [{', '.join([neuron] * nout)}]"
 
 class MLP(Module):
 
     def __init__(self, nin, nouts):
         sz = [nin] + nouts
-        self.layers = [Layer(sz[i], sz[i+1], nonlin=i!=len(nouts)-1) for i in range(len(nouts))]
+        shapes = [(sz[i+1], sz[i]) for i in range(len(nouts))]
+        # the model is born flat: all weights come from one RNG draw laid out at the front
+        # of the parameter buffer (biases follow, starting at zero) and each layer gets views
+        nweights = sum(nout*nin for nout, nin in shapes)
+        self._params_flat = np.zeros(nweights + sum(nout for nout, _ in shapes))
+        self._grads_flat = np.zeros_like(self._params_flat)
+        self._params_flat[:nweights] = np.random.uniform(-1, 1, nweights)
+        self.layers = []
+        w, b = 0, nweights
+        for i, (nout, nin) in enumerate(shapes):
+            W = self._param_view(w, (nout, nin))
+            bias = self._param_view(b, (nout,))
+            self.layers.append(Layer(nin, nout, nonlin=i!=len(nouts)-1, W=W, b=bias))
+            w, b = w + nout*nin, b + nout
+
+    def _param_view(self, i, shape):
+        j = i + int(np.prod(shape))
+        p = TensorValue(self._params_flat[i:j].reshape(shape))
+        p.grad = self._grads_flat[i:j].reshape(shape)
+        return p
 
     def __call__(self, x):
         for layer in self.layers: